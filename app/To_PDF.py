@@ -1,6 +1,9 @@
+import sys
 import requests
 import uuid
 
+URL = "http://127.0.0.1:5000/convert_html_to_pdf"
+
 html = """
 <html>
   <body>
@@ -11,10 +14,15 @@ html = """
 </html>
 """
 
-rid = str(uuid.uuid4())
-resp = requests.post(
-    "http://127.0.0.1:5000/convert_html_to_pdf",
-    json={"request_id": rid, "html": html}
-)
-print(resp.json())
+def send(session, html):
+    rid = str(uuid.uuid4())
+    return session.post(URL, json={"request_id": rid, "html": html})
+
+def main(count=1):
+    # One session so repeated conversions reuse the same connection
+    with requests.Session() as session:
+        for _ in range(count):
+            print(send(session, html).json())
 
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -1,17 +1,28 @@
 import os
-import re
 import time
+import uuid
+import queue
+import atexit
 import json
 import base64
+import shutil
 import logging
+import tempfile
+import subprocess
 import requests
+import threading
 from datetime import datetime
 from functools import wraps
-from collections import defaultdict, deque
+from logging.handlers import QueueHandler, QueueListener
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask, request, jsonify, render_template
+from azure.core.exceptions import ResourceExistsError
 from azure.storage.blob import BlobServiceClient
 from weasyprint import HTML
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+from weasyprint.text.fonts import FontConfiguration
 from dotenv import load_dotenv
 
 # -------------------------------------------------------------------
@@ -27,26 +38,126 @@ BEARER_TOKEN   = os.environ.get("BEARER_TOKEN")
 AZURE_CONN_STR = os.environ.get("AZURE_CONN_STR")
 CONTAINER_NAME = os.environ.get("CONTAINER_NAME", "images")
 
-os.makedirs("static/generated_images", exist_ok=True)
+# Blobs above the single-put threshold are split into blocks that are
+# uploaded in parallel rather than one after another.
+UPLOAD_MAX_CONCURRENCY = int(os.environ.get("UPLOAD_MAX_CONCURRENCY", 8))
+UPLOAD_SINGLE_PUT_SIZE = 4 * 1024 * 1024
+UPLOAD_BLOCK_SIZE      = 8 * 1024 * 1024
+
+# Blob client is built once per process so uploads reuse the SDK's
+# connection pool instead of reparsing the connection string every call.
+_BLOB_SVC = None
+_CONTAINER = None
+if AZURE_CONN_STR:
+    _BLOB_SVC = BlobServiceClient.from_connection_string(
+        AZURE_CONN_STR,
+        max_single_put_size=UPLOAD_SINGLE_PUT_SIZE,
+        max_block_size=UPLOAD_BLOCK_SIZE,
+    )
+    _CONTAINER = _BLOB_SVC.get_container_client(CONTAINER_NAME)
+
+_CONTAINER_READY = False
+_container_lock = threading.Lock()
+
+def _ensure_container_once():
+    """Create the upload container on first use instead of on every upload"""
+    global _CONTAINER_READY
+    if _CONTAINER_READY:
+        return
+    with _container_lock:
+        if _CONTAINER_READY:
+            return
+        try:
+            _CONTAINER.create_container()
+        except ResourceExistsError:
+            pass
+        except Exception as ex:
+            # Left unset so the next upload tries again
+            logger.error("Azure container create error: %s", ex)
+            return
+        _CONTAINER_READY = True
+
+def _is_guid(value):
+    """True for a hyphenated RFC 4122 GUID (versions 1-5), any case"""
+    try:
+        parsed = uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return parsed.version in (1, 2, 3, 4, 5) and str(parsed) == value.lower()
+
+# Font lookup is set up once per render thread for documents that bring no
+# fonts of their own; its Pango font map and caches are not safe to share
+# between threads. A FontConfiguration keeps every @font-face it loads for its
+# whole lifetime, so documents that may declare fonts get a fresh one.
+_font_local = threading.local()
+
+# Images/stylesheets fetched over http(s) while rendering are kept in memory,
+# bounded by total bytes; bigger resources are never cached and entries expire
+# so changed files are picked up again.
+RESOURCE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+RESOURCE_CACHE_MAX_ENTRY = 1024 * 1024
+RESOURCE_CACHE_TTL       = 300
+
+# "weasyprint" (default) or "wkhtmltopdf", which is much faster on heavy pages
+# but cannot resolve relative URLs since the HTML is piped in on stdin.
+PDF_RENDERER    = os.environ.get("PDF_RENDERER", "weasyprint").lower()
+WKHTMLTOPDF_BIN = os.environ.get("WKHTMLTOPDF_BIN") or shutil.which("wkhtmltopdf")
+
+# Rendered PDFs larger than this spill to a temp file while they wait for upload.
+PDF_SPOOL_MAX_SIZE = 8 * 1024 * 1024
 
-GUID_REGEX = re.compile(
-    r"^[0-9a-f]{8}-[0-9a-f]{4}-[1-5][0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$",
-    re.IGNORECASE,
-)
+# -------------------------------------------------------------------
+# BACKGROUND JOBS
+# -------------------------------------------------------------------
+# Long-running work can be handed to this pool so the request thread returns
+# immediately; clients then poll /result/<request_id>. Jobs are tracked in
+# this process only, so with several workers the poll has to reach the worker
+# that queued the job (e.g. sticky sessions); elsewhere it gets a 404.
+EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("JOB_WORKERS", 8)))
+MAX_TRACKED_JOBS = 1000
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+def submit_job(rid, func, *args):
+    """Run func(*args) on the shared executor and track it under rid"""
+    future = EXECUTOR.submit(func, *args)
+    with _jobs_lock:
+        _jobs[rid] = future
+        _jobs.move_to_end(rid)
+        while len(_jobs) > MAX_TRACKED_JOBS:
+            _jobs.popitem(last=False)
+    return future
+
+def get_job(rid):
+    with _jobs_lock:
+        return _jobs.get(rid)
 
 # -------------------------------------------------------------------
 # LOGGING
 # -------------------------------------------------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler(),
-    ],
-)
+_log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+_log_handlers = [
+    logging.FileHandler("app.log"),
+    logging.StreamHandler(),
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+# Request threads only enqueue log records; the listener thread does the
+# actual file and console writes.
+_log_queue = queue.SimpleQueue()
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+_log_listener = QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
 logger = logging.getLogger("image_generator")
 
+if PDF_RENDERER == "wkhtmltopdf" and not WKHTMLTOPDF_BIN:
+    logger.warning("PDF_RENDERER=wkhtmltopdf but no binary found; using WeasyPrint")
+
 # -------------------------------------------------------------------
 # PERFORMANCE METRICS
 # -------------------------------------------------------------------
@@ -63,7 +174,7 @@ class AppMetrics:
     def record_request(self, endpoint, method):
         self.request_count += 1
         self.total_requests[f"{method} {endpoint}"] += 1
-        logger.info(f"Request #{self.request_count} - {method} {endpoint}")
+        logger.info("Request #%d - %s %s", self.request_count, method, endpoint)
 
     def record_response_time(self, duration, success=True):
         self.response_times.append(duration)
@@ -74,7 +185,7 @@ class AppMetrics:
 
     def record_error(self, error_type, error_message):
         self.error_count[error_type] += 1
-        logger.error(f"Error recorded: {error_type} - {error_message}")
+        logger.error("Error recorded: %s - %s", error_type, error_message)
 
     def get_stats(self):
         uptime = time.time() - self.start_time
@@ -118,13 +229,13 @@ def monitor_performance(func):
                 pass
 
         app_metrics.record_request(endpoint, getattr(request, "method", "UNKNOWN"))
-        logger.info(f"STARTING {func.__name__} - Request ID: {request_id}")
+        logger.info("STARTING %s - Request ID: %s", func.__name__, request_id)
 
         try:
             result = func(*args, **kwargs)
             duration = time.time() - start_time
             app_metrics.record_response_time(duration, success=True)
-            logger.info(f"SUCCESS {func.__name__} - Duration: {duration:.2f}s - Request ID: {request_id}")
+            logger.info("SUCCESS %s - Duration: %.2fs - Request ID: %s", func.__name__, duration, request_id)
             return result
         except Exception as e:
             duration = time.time() - start_time
@@ -132,7 +243,8 @@ def monitor_performance(func):
             app_metrics.record_response_time(duration, success=False)
             app_metrics.record_error(error_type, str(e))
             logger.error(
-                f"FAILED {func.__name__} - Duration: {duration:.2f}s - Error: {error_type}: {str(e)} - Request ID: {request_id}"
+                "FAILED %s - Duration: %.2fs - Error: %s: %s - Request ID: %s",
+                func.__name__, duration, error_type, e, request_id
             )
             raise
     return wrapper
@@ -140,7 +252,8 @@ def monitor_performance(func):
 def log_request_details(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        if request.is_json:
+        # The details dict and its JSON dump are only built when INFO is on
+        if request.is_json and logger.isEnabledFor(logging.INFO):
             data = request.get_json(force=True)
             log_data = {
                 "timestamp": datetime.now().isoformat(),
@@ -157,7 +270,7 @@ def log_request_details(func):
                 "user_agent": request.headers.get("User-Agent", "unknown")[:100],
                 "ip_address": request.remote_addr,
             }
-            logger.info(f"REQUEST DETAILS: {json.dumps(log_data, indent=2)}")
+            logger.info("REQUEST DETAILS: %s", json.dumps(log_data, indent=2))
         return func(*args, **kwargs)
     return wrapper
 
@@ -175,7 +288,7 @@ def validate_request_data(data):
     rid = data.get("request_id")
     if not rid:
         return False, "Missing request_id"
-    if not GUID_REGEX.match(rid):
+    if not _is_guid(rid):
         return False, "request_id must be a valid GUID"
     return True, "Valid"
 
@@ -190,7 +303,7 @@ def process_image_request(data):
         return {"status": "error", "message": "Missing prompt"}
     
     # Simulate processing (replace with actual RunPod call)
-    logger.info(f"Processing image request: {rid} - '{prompt}' at {width}x{height}")
+    logger.info("Processing image request: %s - '%s' at %sx%s", rid, prompt, width, height)
     return {
         "status": "success", 
         "message": "Image generation completed",
@@ -206,14 +319,12 @@ def process_pdf_request(data):
     
     if not html_content:
         return {"status": "error", "message": "Missing html content"}
+    # request_id becomes the blob name, so it has to be a GUID
+    if not _is_guid(rid):
+        return {"status": "error", "message": "request_id must be a valid GUID"}
     
     try:
-        pdf_filename = f"{rid}.pdf"
-        pdf_path = os.path.join("static/generated_images", pdf_filename)
-        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
-        
-        HTML(string=html_content, base_url="http://localhost:8000/").write_pdf(pdf_path)
-        blob_url = upload_blob(pdf_path, pdf_filename)
+        blob_url = render_pdf_to_blob(html_content, f"{rid}.pdf", "http://localhost:8000/")
         
         return {
             "status": "success",
@@ -224,24 +335,145 @@ def process_pdf_request(data):
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+_resource_cache = OrderedDict()
+_resource_cache_bytes = 0
+_resource_cache_lock = threading.Lock()
+
+def _cache_get(url):
+    with _resource_cache_lock:
+        entry = _resource_cache.get(url)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            _cache_drop(url)
+            return None
+        _resource_cache.move_to_end(url)
+        return entry
+
+def _cache_put(url, entry):
+    global _resource_cache_bytes
+    with _resource_cache_lock:
+        if url in _resource_cache:
+            _cache_drop(url)
+        _resource_cache[url] = entry
+        _resource_cache_bytes += len(entry[2])
+        while _resource_cache_bytes > RESOURCE_CACHE_MAX_BYTES:
+            _cache_drop(next(iter(_resource_cache)))
+
+def _cache_drop(url):
+    global _resource_cache_bytes
+    _resource_cache_bytes -= len(_resource_cache.pop(url)[2])
+
+class CachingURLFetcher(URLFetcher):
+    """WeasyPrint URL fetcher that keeps small, recently used http(s) resources in memory"""
+
+    def fetch(self, url, headers=None):
+        if headers or not url.startswith(("http://", "https://")):
+            return super().fetch(url, headers)
+        entry = _cache_get(url)
+        if entry is None:
+            response = super().fetch(url)
+            length = response.headers.get("Content-Length")
+            if response.status != 200 or (length and int(length) > RESOURCE_CACHE_MAX_ENTRY):
+                return response
+            try:
+                body = response.read()
+            finally:
+                response.close()
+            entry = (
+                time.monotonic() + RESOURCE_CACHE_TTL,
+                response.url,
+                body,
+                dict(response.headers.items()),
+            )
+            if len(body) <= RESOURCE_CACHE_MAX_ENTRY:
+                _cache_put(url, entry)
+        _, final_url, body, response_headers = entry
+        return URLFetcherResponse(final_url, body, response_headers)
+
+def font_config_for(html_content):
+    """This thread's FontConfiguration unless the document can pull in @font-face rules"""
+    lowered = html_content.lower()
+    if "@font-face" in lowered or "@import" in lowered or "<link" in lowered:
+        return FontConfiguration()
+    font_config = getattr(_font_local, "font_config", None)
+    if font_config is None:
+        font_config = _font_local.font_config = FontConfiguration()
+    return font_config
+
+def render_pdf(html_content, base_url):
+    """Render HTML to PDF; returns a rewound file object and its size in bytes"""
+    out = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_SIZE)
+    try:
+        if PDF_RENDERER == "wkhtmltopdf" and WKHTMLTOPDF_BIN:
+            subprocess.run(
+                [WKHTMLTOPDF_BIN, "--quiet", "-", "-"],
+                input=html_content.encode("utf-8"),
+                stdout=out,
+                stderr=subprocess.PIPE,
+                check=True,
+                timeout=120,
+            )
+        else:
+            HTML(
+                string=html_content, base_url=base_url, url_fetcher=CachingURLFetcher()
+            ).write_pdf(out, font_config=font_config_for(html_content))
+        size = out.seek(0, os.SEEK_END)
+        out.seek(0)
+    except Exception:
+        out.close()
+        raise
+    return out, size
+
+def render_pdf_to_blob(html_content, pdf_filename, base_url):
+    """Render HTML to PDF and upload it, returning the blob URL"""
+    pdf_file, size = render_pdf(html_content, base_url)
+    with pdf_file:
+        return upload_blob_data(pdf_file, pdf_filename, length=size)
+
+def pdf_job(rid, html_content, base_url):
+    """Background variant of /convert_html_to_pdf; returns the response body"""
+    try:
+        blob_url = render_pdf_to_blob(html_content, f"{rid}.pdf", base_url)
+    except Exception as e:
+        logger.exception("PDF generation error")
+        return {"status": "error", "message": str(e)}
+    if blob_url is None:
+        return {"status": "error", "message": "Blob upload failed"}
+    return {"status": "success", "pdf_blob_url": blob_url}
+
+def upload_job(pdf_file, size, blob_name):
+    """Background blob upload; returns the response body for /result"""
+    with pdf_file:
+        blob_url = upload_blob_data(pdf_file, blob_name, length=size)
+    if blob_url is None:
+        return {"status": "error", "message": "Blob upload failed"}
+    return {"status": "success", "pdf_blob_url": blob_url}
+
 def get_metrics():
     """Get current application metrics"""
     return app_metrics.get_stats()
 
-def upload_blob(local_path, blob_name):
+def blob_url_for(blob_name):
+    return f"https://whiperimages.blob.core.windows.net/{CONTAINER_NAME}/{blob_name}"
+
+def upload_blob_data(data, blob_name, length=None):
+    """Upload bytes or a readable stream straight to blob storage"""
+    if _CONTAINER is None:
+        logger.error("Azure Blob upload error: AZURE_CONN_STR is not configured")
+        return None
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(AZURE_CONN_STR)
-        container_client = blob_service_client.get_container_client(CONTAINER_NAME)
-        try:
-            container_client.create_container()
-        except Exception:
-            pass
-        blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=blob_name)
-        with open(local_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
-        return f"https://whiperimages.blob.core.windows.net/{CONTAINER_NAME}/{blob_name}"
+        _ensure_container_once()
+        blob_client = _CONTAINER.get_blob_client(blob_name)
+        blob_client.upload_blob(
+            data,
+            overwrite=True,
+            length=length,
+            max_concurrency=UPLOAD_MAX_CONCURRENCY,
+        )
+        return blob_url_for(blob_name)
     except Exception as ex:
-        logger.error(f"Azure Blob upload error: {ex}")
+        logger.error("Azure Blob upload error: %s", ex)
         return None
 
 # -------------------------------------------------------------------
@@ -261,13 +493,13 @@ def generate_image():
     width = data.get("width", 512)
     height = data.get("height", 512)
 
-    logger.info(f"IMAGE GENERATION REQUEST: ID={rid}, Prompt='{prompt[:100]}', Dimensions={width}x{height}")
+    logger.info("IMAGE GENERATION REQUEST: ID=%s, Prompt='%.100s', Dimensions=%sx%s", rid, prompt, width, height)
 
     # Validation
     if not all([rid, prompt]):
         app_metrics.record_error("VALIDATION_ERROR", "Missing required fields")
         return jsonify(status="error", message="Missing request_id or prompt"), 400
-    if not GUID_REGEX.match(rid):
+    if not _is_guid(rid):
         app_metrics.record_error("VALIDATION_ERROR", "Invalid GUID format")
         return jsonify(status="error", message="request_id must be a valid GUID"), 400
 
@@ -279,7 +511,7 @@ def generate_image():
     payload = {"input": {"prompt": prompt, "width": width, "height": height}}
 
     # --- Stub (replace with actual RunPod call) ---
-    logger.info(f"Would generate image with prompt: '{prompt}' at {width}x{height}")
+    logger.info("Would generate image with prompt: '%s' at %sx%s", prompt, width, height)
     return jsonify(status="info", message="Stub - replace with RunPod call", request_id=rid)
 
 @app.route("/convert_html_to_pdf", methods=["POST"])
@@ -291,21 +523,35 @@ def convert_html_to_pdf():
 
     if not rid or not html_content:
         return jsonify(status="error", message="Missing request_id or html"), 400
-    if not GUID_REGEX.match(rid):
+    if not _is_guid(rid):
         return jsonify(status="error", message="request_id must be a valid GUID"), 400
 
-    try:
-        pdf_filename = f"{rid}.pdf"
-        pdf_path = os.path.join("static/generated_images", pdf_filename)
-        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+    if data.get("async"):
+        submit_job(rid, pdf_job, rid, html_content, request.host_url)
+        return jsonify(status="queued", request_id=rid), 202
 
-        HTML(string=html_content, base_url=request.host_url).write_pdf(pdf_path)
-        blob_url = upload_blob(pdf_path, pdf_filename)
-        return jsonify(status="success", pdf_blob_url=blob_url)
+    try:
+        pdf_file, size = render_pdf(html_content, request.host_url)
     except Exception as e:
         logger.exception("PDF generation error")
         return jsonify(status="error", message=str(e)), 500
 
+    # The upload finishes in the background; /result/<request_id> reports
+    # whether it landed.
+    pdf_filename = f"{rid}.pdf"
+    submit_job(rid, upload_job, pdf_file, size, pdf_filename)
+    blob_url = blob_url_for(pdf_filename) if _CONTAINER is not None else None
+    return jsonify(status="success", pdf_blob_url=blob_url, upload_status="pending")
+
+@app.route("/result/<rid>", methods=["GET"])
+def get_result(rid):
+    future = get_job(rid)
+    if future is None:
+        return jsonify(status="error", message="Unknown request_id"), 404
+    if not future.done():
+        return jsonify(status="running", request_id=rid), 202
+    return jsonify(request_id=rid, **future.result())
+
 @app.route("/stats", methods=["GET"])
 def get_stats():
     stats = app_metrics.get_stats()
@@ -0,0 +1,27 @@
+"""
+Gunicorn settings for the MCP web server
+
+    cd app && gunicorn -c gunicorn.conf.py mcp_web_server:mcp_app
+
+Each worker process keeps its own in-memory metrics, so /mcp/metrics reports
+on whichever worker served the request.
+"""
+
+import os
+import multiprocessing
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:9000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2 * multiprocessing.cpu_count() + 1))
+
+# Threads give I/O concurrency (blob uploads, PDF fetches) without another
+# copy of the app per request.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# Keep worker heartbeat files on tmpfs so they never wait on disk sync
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+# Hold idle client connections open so the browser UI reuses one socket
+# across clicks; keep this above any fronting proxy's idle timeout.
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 65))
@@ -4,11 +4,10 @@ MCP Server for Whisperwynd Story Generator
 4th Contribution: Integration test layer using MCP server interface
 """
 
-import json
 import time
 import asyncio
 from typing import Any, Dict, List
-from datetime import datetime
+from datetime import datetime, timezone
 
 from mcp.server import Server
 from mcp.server.models import InitializationOptions
@@ -21,6 +20,7 @@ from mcp.types import (
     EmbeddedResource,
     LoggingLevel
 )
+import orjson
 from pydantic import BaseModel
 
 # Import core functions from our Flask app
@@ -51,6 +51,28 @@ class MCPResponse(BaseModel):
     metrics: Dict[str, Any] = {}
     timestamp: str
 
+# Same fields as MCPResponse. Tool calls copy this instead of building and
+# validating a pydantic model per call.
+_RESP_TMPL = {
+    "request_id": None,
+    "status": None,
+    "message": None,
+    "data": None,
+    "metrics": None,
+    "timestamp": None,
+}
+
+def make_response(request_id, status, message, data=None, metrics=None):
+    """Build an MCPResponse-shaped dict"""
+    response = _RESP_TMPL.copy()
+    response["request_id"] = request_id
+    response["status"] = status
+    response["message"] = message
+    response["data"] = data if data is not None else {}
+    response["metrics"] = metrics if metrics is not None else {}
+    response["timestamp"] = datetime.now(timezone.utc).isoformat()
+    return response
+
 # -------------------------------------------------------------------
 # MCP TOOLS
 # -------------------------------------------------------------------
@@ -132,55 +154,53 @@ async def handle_list_tools() -> List[Tool]:
 async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
     """Handle MCP tool calls"""
     start_time = time.time()
+    snapshot = None
     
     try:
+        # One metrics snapshot per call, shared by whichever branch runs
+        snapshot = get_metrics()
+        
         if name == "validate_request":
             request_data = arguments.get("request_data", {})
             is_valid, message = validate_request_data(request_data)
             
-            response = MCPResponse(
+            response = make_response(
                 request_id=request_data.get("request_id", "unknown"),
                 status="success" if is_valid else "error",
                 message=message,
                 data={"is_valid": is_valid},
-                metrics=get_metrics(),
-                timestamp=datetime.now().isoformat()
+                metrics=snapshot
             )
             
         elif name == "process_image_generation":
-            result = process_image_request(arguments)
+            result = await asyncio.to_thread(process_image_request, arguments)
             
-            response = MCPResponse(
+            response = make_response(
                 request_id=arguments.get("request_id", "unknown"),
                 status=result.get("status", "error"),
                 message=result.get("message", "Unknown error"),
                 data=result,
-                metrics=get_metrics(),
-                timestamp=datetime.now().isoformat()
+                metrics=snapshot
             )
             
         elif name == "process_pdf_conversion":
-            result = process_pdf_request(arguments)
+            result = await asyncio.to_thread(process_pdf_request, arguments)
             
-            response = MCPResponse(
+            response = make_response(
                 request_id=arguments.get("request_id", "unknown"),
                 status=result.get("status", "error"),
                 message=result.get("message", "Unknown error"),
                 data=result,
-                metrics=get_metrics(),
-                timestamp=datetime.now().isoformat()
+                metrics=snapshot
             )
             
         elif name == "get_system_metrics":
-            metrics = get_metrics()
-            
-            response = MCPResponse(
+            response = make_response(
                 request_id="metrics_request",
                 status="success",
                 message="Metrics retrieved successfully",
-                data=metrics,
-                metrics=metrics,
-                timestamp=datetime.now().isoformat()
+                data=snapshot,
+                metrics=snapshot
             )
             
         elif name == "run_integration_test":
@@ -198,31 +218,29 @@ async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> List[TextCon
             })
             
             if is_valid:
-                # Run processing tests based on type
-                if test_type in ["image", "both"]:
-                    if arguments.get("prompt"):
-                        img_result = process_image_request(arguments)
-                        test_results.append({
-                            "test": "image_processing",
-                            "status": "passed" if img_result.get("status") == "success" else "failed",
-                            "message": img_result.get("message", "Unknown error"),
-                            "data": img_result
-                        })
+                # Run processing tests based on type; they are independent, so
+                # image and PDF work overlap instead of running back to back
+                steps = []
+                if test_type in ["image", "both"] and arguments.get("prompt"):
+                    steps.append(("image_processing", process_image_request))
+                if test_type in ["pdf", "both"] and arguments.get("html"):
+                    steps.append(("pdf_processing", process_pdf_request))
                 
-                if test_type in ["pdf", "both"]:
-                    if arguments.get("html"):
-                        pdf_result = process_pdf_request(arguments)
-                        test_results.append({
-                            "test": "pdf_processing", 
-                            "status": "passed" if pdf_result.get("status") == "success" else "failed",
-                            "message": pdf_result.get("message", "Unknown error"),
-                            "data": pdf_result
-                        })
+                results = await asyncio.gather(
+                    *(asyncio.to_thread(processor, arguments) for _, processor in steps)
+                )
+                for (test_name, _), result in zip(steps, results):
+                    test_results.append({
+                        "test": test_name,
+                        "status": "passed" if result.get("status") == "success" else "failed",
+                        "message": result.get("message", "Unknown error"),
+                        "data": result
+                    })
             
             # Calculate overall test status
             all_passed = all(test.get("status") == "passed" for test in test_results)
             
-            response = MCPResponse(
+            response = make_response(
                 request_id=request_id,
                 status="success" if all_passed else "partial_failure",
                 message=f"Integration test completed - {len([t for t in test_results if t.get('status') == 'passed'])}/{len(test_results)} tests passed",
@@ -230,30 +248,28 @@ async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> List[TextCon
                     "test_results": test_results,
                     "overall_status": "passed" if all_passed else "failed"
                 },
-                metrics=get_metrics(),
-                timestamp=datetime.now().isoformat()
+                metrics=snapshot
             )
             
         else:
-            response = MCPResponse(
+            response = make_response(
                 request_id="unknown",
                 status="error",
                 message=f"Unknown tool: {name}",
                 data={},
-                metrics={},
-                timestamp=datetime.now().isoformat()
+                metrics={}
             )
         
         # Record performance metrics
         duration = time.time() - start_time
-        app_metrics.record_response_time(duration, success=(response.status != "error"))
+        app_metrics.record_response_time(duration, success=(response["status"] != "error"))
         
         # Log the MCP operation
-        logger.info(f"MCP Tool '{name}' - Status: {response.status} - Duration: {duration:.3f}s")
+        logger.info("MCP Tool '%s' - Status: %s - Duration: %.3fs", name, response["status"], duration)
         
         return [TextContent(
             type="text",
-            text=json.dumps(response.dict(), indent=2)
+            text=orjson.dumps(response).decode()
         )]
         
     except Exception as e:
@@ -261,20 +277,19 @@ async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> List[TextCon
         app_metrics.record_response_time(duration, success=False)
         app_metrics.record_error("MCP_ERROR", str(e))
         
-        error_response = MCPResponse(
+        error_response = make_response(
             request_id=arguments.get("request_id", "unknown"),
             status="error",
             message=f"MCP server error: {str(e)}",
             data={},
-            metrics=get_metrics(),
-            timestamp=datetime.now().isoformat()
+            metrics=snapshot if snapshot is not None else {}
         )
         
-        logger.error(f"MCP Tool '{name}' failed - Duration: {duration:.3f}s - Error: {str(e)}")
+        logger.error("MCP Tool '%s' failed - Duration: %.3fs - Error: %s", name, duration, e)
         
         return [TextContent(
             type="text", 
-            text=json.dumps(error_response.dict(), indent=2)
+            text=orjson.dumps(error_response).decode()
         )]
 
 # -------------------------------------------------------------------
@@ -310,7 +325,7 @@ async def handle_read_resource(uri: str) -> str:
     """Read MCP resource content"""
     if uri == "whisperwynd://metrics":
         metrics = get_metrics()
-        return json.dumps(metrics, indent=2)
+        return orjson.dumps(metrics).decode()
         
     elif uri == "whisperwynd://health":
         health_data = {
@@ -322,7 +337,7 @@ async def handle_read_resource(uri: str) -> str:
                 "success_rate": f"{(app_metrics.successful_generations / max(1, app_metrics.successful_generations + app_metrics.failed_generations) * 100):.1f}%"
             }
         }
-        return json.dumps(health_data, indent=2)
+        return orjson.dumps(health_data).decode()
         
     elif uri == "whisperwynd://test-examples":
         examples = {
@@ -352,7 +367,7 @@ async def handle_read_resource(uri: str) -> str:
                 }
             }
         }
-        return json.dumps(examples, indent=2)
+        return orjson.dumps(examples).decode()
     
     else:
         raise ValueError(f"Unknown resource: {uri}")
@@ -390,4 +405,4 @@ if __name__ == "__main__":
         print("\n MCP Server stopped by user")
     except Exception as e:
         print(f"MCP Server error: {e}")
-        logger.error(f"MCP Server startup failed: {e}")
+        logger.error("MCP Server startup failed: %s", e)
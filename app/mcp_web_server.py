@@ -4,11 +4,21 @@ Web-based MCP Server for Whisperwynd Story Generator
 Provides localhost interface to test MCP functionality
 """
 
-import json
+import os
+import gzip
 import time
 import uuid
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template_string
+import hashlib
+import secrets
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+from asgiref.wsgi import WsgiToAsgi
+from flask import Flask, Response, request
+from werkzeug.exceptions import BadRequest
 
 # Import core functions from our main app
 from app import (
@@ -25,20 +35,105 @@ from app import (
 # -------------------------------------------------------------------
 mcp_app = Flask(__name__)
 
+# Monotonic, integer-nanosecond clock for request durations
+_pc = time.perf_counter_ns
+
+# Reused across requests so integration tests don't spawn threads per call
+_EXEC = ThreadPoolExecutor(max_workers=4)
+
+# Caps concurrent integration runs (each may kick off image + PDF work);
+# requests that can't get a slot in time are turned away with a 503
+_HEAVY_SEM = threading.BoundedSemaphore(max(1, (os.cpu_count() or 2) // 2))
+_HEAVY_WAIT_SECONDS = float(os.environ.get("MCP_HEAVY_WAIT_SECONDS", 5))
+_HEAVY_RETRY_AFTER = "5"
+
+def _slot_releaser():
+    """Release for one _HEAVY_SEM slot; only the first call releases"""
+    lock = threading.Lock()
+    pending = [True]
+    def release():
+        with lock:
+            if not pending:
+                return
+            pending.clear()
+        _HEAVY_SEM.release()
+    return release
+
+def _run_step(name, fn, data, **kwargs):
+    """Run one processor; returns (ok, result, duration_ns)"""
+    start_ns = _pc()
+    result = fn(data, **kwargs)
+    duration_ns = _pc() - start_ns
+    logger.debug("MCP step %s - Duration: %dns", name, duration_ns)
+    return result.get("status") == "success", result, duration_ns
+
+# Random bytes for test UUIDs are drawn in batches, one urandom read per pool
+_UUID_POOL_SIZE = 256
+_uuid_pool = []
+_uuid_lock = threading.Lock()
+
 def generate_test_uuid():
     """Generate a valid UUID for testing"""
-    return str(uuid.uuid4())
+    with _uuid_lock:
+        if not _uuid_pool:
+            raw = secrets.token_bytes(16 * _UUID_POOL_SIZE)
+            _uuid_pool.extend(raw[i:i + 16] for i in range(0, len(raw), 16))
+        chunk = _uuid_pool.pop()
+    return str(uuid.UUID(bytes=chunk, version=4))
+
+@lru_cache(maxsize=1)
+def _cached_metrics(bucket):
+    return get_metrics()
+
+def metrics_snapshot():
+    """get_metrics(), shared by every response built in the same 500 ms window"""
+    return _cached_metrics(int(time.monotonic() * 2))
+
+_ts_cache = (0, "")
+
+def iso_now():
+    """UTC ISO-8601 timestamp at second resolution, formatted at most once a second"""
+    global _ts_cache
+    now = int(time.time())
+    cached = _ts_cache
+    if cached[0] != now:
+        cached = (now, datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+        _ts_cache = cached
+    return cached[1]
+
+# Fixed key layout of every MCP response; copied per request
+_RESP_SKELETON = {
+    "request_id": None,
+    "status": None,
+    "message": None,
+    "data": None,
+    "metrics": None,
+    "timestamp": None
+}
 
 def create_mcp_response(request_id, status, message, data=None, metrics=None):
     """Create standardized MCP response"""
-    return {
-        "request_id": request_id,
-        "status": status,
-        "message": message,
-        "data": data or {},
-        "metrics": metrics or get_metrics(),
-        "timestamp": datetime.now().isoformat()
-    }
+    if metrics is None:
+        metrics = metrics_snapshot()
+    response = _RESP_SKELETON.copy()
+    response["request_id"] = request_id
+    response["status"] = status
+    response["message"] = message
+    response["data"] = data or {}
+    response["metrics"] = metrics
+    response["timestamp"] = iso_now()
+    return response
+
+def orjson_response(obj, status=200):
+    """JSON response encoded with orjson rather than jsonify's stdlib encoder"""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def request_json():
+    """Parse the request body with orjson; bad JSON is a 400 like get_json(force=True)"""
+    try:
+        return orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        raise BadRequest("Failed to decode JSON object")
 
 # -------------------------------------------------------------------
 # WEB INTERFACE
@@ -180,6 +275,8 @@ MCP_INTERFACE_HTML = """
             font-family: 'Courier New', monospace;
             font-size: 13px;
             line-height: 1.5;
+            white-space: pre-wrap;
+            word-break: break-word;
         }
         .metrics { 
             background: linear-gradient(135deg, #e8f5e8 0%, #f0f8f0 100%);
@@ -346,12 +443,7 @@ MCP_INTERFACE_HTML = """
 
     <script>
         function generateUUID(inputId) {
-            const uuid = 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
-                const r = Math.random() * 16 | 0;
-                const v = c == 'x' ? r : (r & 0x3 | 0x8);
-                return v.toString(16);
-            });
-            document.getElementById(inputId).value = uuid;
+            document.getElementById(inputId).value = generateTestUUID();
         }
 
         async function makeRequest(endpoint, data) {
@@ -367,42 +459,83 @@ MCP_INTERFACE_HTML = """
             }
         }
 
+        // Reads an NDJSON body, calling onLine for each object as it arrives
+        async function makeStreamRequest(endpoint, data, onLine) {
+            const response = await fetch(endpoint, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(data)
+            });
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = '';
+            while (true) {
+                const {done, value} = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, {stream: true});
+                let newline;
+                while ((newline = buffered.indexOf('\\n')) >= 0) {
+                    const line = buffered.slice(0, newline);
+                    buffered = buffered.slice(newline + 1);
+                    if (line) onLine(JSON.parse(line));
+                }
+            }
+            if (buffered.trim()) onLine(JSON.parse(buffered));
+        }
+
+        // Walk already-parsed values into indented lines instead of
+        // re-serializing nested objects with JSON.stringify
+        function pushValueLines(lines, label, value, indent) {
+            if (value !== null && typeof value === 'object') {
+                const entries = Object.entries(value);
+                if (entries.length === 0) {
+                    lines.push(`${indent}${label}: ${Array.isArray(value) ? '[]' : '{}'}`);
+                    return;
+                }
+                lines.push(`${indent}${label}:`);
+                const inner = indent + '  ';
+                for (const [key, item] of entries) {
+                    pushValueLines(lines, key, item, inner);
+                }
+            } else {
+                lines.push(`${indent}${label}: ${value}`);
+            }
+        }
+
         function formatResponseText(response) {
-            let output = [];
+            const lines = [];
             
             // Basic info
-            output.push(`Status: ${response.status}`);
-            output.push(`Message: ${response.message}`);
-            output.push(`Request ID: ${response.request_id}`);
-            output.push(`Timestamp: ${new Date(response.timestamp).toLocaleString()}`);
+            lines.push(`Status: ${response.status}`);
+            lines.push(`Message: ${response.message}`);
+            lines.push(`Request ID: ${response.request_id}`);
+            lines.push(`Timestamp: ${new Date(response.timestamp).toLocaleString()}`);
             
             // Data section
             if (response.data && Object.keys(response.data).length > 0) {
-                output.push('\n--- Response Data ---');
+                lines.push('', '--- Response Data ---');
                 for (const [key, value] of Object.entries(response.data)) {
                     if (key === 'test_results' && Array.isArray(value)) {
-                        output.push(`${key}:`);
+                        lines.push(`${key}:`);
                         value.forEach((test, i) => {
-                            output.push(`  Test ${i + 1}: ${test.test} - ${test.status}`);
-                            output.push(`    Message: ${test.message}`);
+                            lines.push(`  Test ${i + 1}: ${test.test} - ${test.status}`);
+                            lines.push(`    Message: ${test.message}`);
                         });
-                    } else if (typeof value === 'object') {
-                        output.push(`${key}: ${JSON.stringify(value, null, 2)}`);
                     } else {
-                        output.push(`${key}: ${value}`);
+                        pushValueLines(lines, key, value, '');
                     }
                 }
             }
             
             // Metrics section
             if (response.metrics && Object.keys(response.metrics).length > 0) {
-                output.push('\n--- System Metrics ---');
+                lines.push('', '--- System Metrics ---');
                 for (const [key, value] of Object.entries(response.metrics)) {
-                    output.push(`${key}: ${value}`);
+                    lines.push(`${key}: ${value}`);
                 }
             }
             
-            return output.join('\n');
+            return lines.join('\\n');
         }
 
         function displayResponse(elementId, response) {
@@ -420,10 +553,10 @@ MCP_INTERFACE_HTML = """
                     ${statusBadge}
                     ${response.status.toUpperCase().replace('_', ' ')}
                 </div>
-                <div class="response-content">
-                    ${formatResponseText(response)}
-                </div>
+                <div class="response-content"></div>
             `;
+            // Server-provided text goes in as a single text node, never through the HTML parser
+            element.querySelector('.response-content').textContent = formatResponseText(response);
         }
 
         async function getMetrics() {
@@ -497,11 +630,26 @@ MCP_INTERFACE_HTML = """
                 prompt: document.getElementById('integration-prompt').value,
                 html: document.getElementById('integration-html').value
             };
-            const response = await makeRequest('/mcp/integration', data);
+            const testResults = [];
+            let response = null;
+            try {
+                await makeStreamRequest('/mcp/integration?stream=1', data, line => {
+                    if ('test' in line) testResults.push(line);
+                    else response = line;
+                });
+            } catch (error) {
+                response = {status: 'error', message: 'Network error: ' + error.message};
+            }
+            response = response || {status: 'error', message: 'Incomplete response from server'};
+            response.data = Object.assign({test_results: testResults}, response.data);
             displayResponse('integration-response', response);
         }
 
         function generateTestUUID() {
+            // crypto.randomUUID is only exposed in secure contexts (https, localhost)
+            if (window.crypto && crypto.randomUUID) {
+                return crypto.randomUUID();
+            }
             return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
                 const r = Math.random() * 16 | 0;
                 const v = c == 'x' ? r : (r & 0x3 | 0x8);
@@ -518,6 +666,16 @@ MCP_INTERFACE_HTML = """
 </html>
 """
 
+def _minify_html(html):
+    """Drop indentation and blank lines; newlines are kept so inline JS is unchanged"""
+    return "\n".join(line.strip() for line in html.splitlines() if line.strip())
+
+# The page has no template variables, so it is minified, encoded and
+# gzip-compressed once at import instead of going through Jinja on every hit.
+MCP_INTERFACE_BYTES = _minify_html(MCP_INTERFACE_HTML).encode("utf-8")
+MCP_INTERFACE_GZIP = gzip.compress(MCP_INTERFACE_BYTES, compresslevel=9)
+MCP_INTERFACE_ETAG = hashlib.md5(MCP_INTERFACE_BYTES).hexdigest()
+
 # -------------------------------------------------------------------
 # WEB MCP ENDPOINTS
 # -------------------------------------------------------------------
@@ -525,15 +683,29 @@ MCP_INTERFACE_HTML = """
 @mcp_app.route('/')
 def mcp_interface():
     """MCP testing web interface"""
-    return render_template_string(MCP_INTERFACE_HTML)
+    if request.accept_encodings["gzip"]:
+        response = Response(MCP_INTERFACE_GZIP, mimetype="text/html")
+        response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(MCP_INTERFACE_ETAG + "-gz")
+    else:
+        response = Response(MCP_INTERFACE_BYTES, mimetype="text/html")
+        response.set_etag(MCP_INTERFACE_ETAG)
+    response.headers["Cache-Control"] = "public, max-age=3600"
+    response.vary.add("Accept-Encoding")
+    return response.make_conditional(request)
+
+@mcp_app.route('/healthz')
+def mcp_healthz():
+    """Liveness probe for load balancers: no metrics, no JSON, no logging"""
+    return b"ok", 200, {"Content-Type": "text/plain"}
 
 @mcp_app.route('/mcp/metrics', methods=['POST'])
 def mcp_get_metrics():
     """Get system metrics via MCP interface"""
-    start_time = time.time()
+    start_ns = _pc()
     try:
-        metrics = get_metrics()
-        duration = time.time() - start_time
+        metrics = metrics_snapshot()
+        duration = (_pc() - start_ns) * 1e-9
         
         response = create_mcp_response(
             request_id="metrics_request",
@@ -543,11 +715,11 @@ def mcp_get_metrics():
             metrics=metrics
         )
         
-        logger.info(f"MCP Metrics request - Duration: {duration:.3f}s")
-        return jsonify(response)
+        logger.info("MCP Metrics request - Duration: %.3fs", duration)
+        return orjson_response(response)
         
     except Exception as e:
-        duration = time.time() - start_time
+        duration = (_pc() - start_ns) * 1e-9
         app_metrics.record_error("MCP_METRICS_ERROR", str(e))
         
         response = create_mcp_response(
@@ -556,18 +728,18 @@ def mcp_get_metrics():
             message=f"Failed to get metrics: {str(e)}"
         )
         
-        logger.error(f"MCP Metrics failed - Duration: {duration:.3f}s - Error: {str(e)}")
-        return jsonify(response), 500
+        logger.error("MCP Metrics failed - Duration: %.3fs - Error: %s", duration, e)
+        return orjson_response(response, 500)
 
 @mcp_app.route('/mcp/validate', methods=['POST'])
 def mcp_validate():
     """Validate request via MCP interface"""
-    start_time = time.time()
-    data = request.get_json(force=True)
+    start_ns = _pc()
+    data = request_json()
     
     try:
         is_valid, message = validate_request_data(data)
-        duration = time.time() - start_time
+        duration = (_pc() - start_ns) * 1e-9
         app_metrics.record_response_time(duration, success=is_valid)
         
         response = create_mcp_response(
@@ -577,11 +749,11 @@ def mcp_validate():
             data={"is_valid": is_valid, "validation_details": message}
         )
         
-        logger.info(f"MCP Validation - Duration: {duration:.3f}s - Valid: {is_valid}")
-        return jsonify(response)
+        logger.info("MCP Validation - Duration: %.3fs - Valid: %s", duration, is_valid)
+        return orjson_response(response)
         
     except Exception as e:
-        duration = time.time() - start_time
+        duration = (_pc() - start_ns) * 1e-9
         app_metrics.record_response_time(duration, success=False)
         app_metrics.record_error("MCP_VALIDATION_ERROR", str(e))
         
@@ -591,31 +763,32 @@ def mcp_validate():
             message=f"Validation error: {str(e)}"
         )
         
-        logger.error(f"MCP Validation failed - Duration: {duration:.3f}s - Error: {str(e)}")
-        return jsonify(response), 500
+        logger.error("MCP Validation failed - Duration: %.3fs - Error: %s", duration, e)
+        return orjson_response(response, 500)
 
 @mcp_app.route('/mcp/image', methods=['POST'])
 def mcp_process_image():
     """Process image generation via MCP interface"""
-    start_time = time.time()
-    data = request.get_json(force=True)
+    start_ns = _pc()
+    data = request_json()
     
     try:
         # First validate
         is_valid, validation_msg = validate_request_data(data)
         if not is_valid:
+            # Empty metrics skip the snapshot so bad input is rejected cheaply
             response = create_mcp_response(
                 request_id=data.get("request_id", "unknown"),
                 status="validation_failed",
-                message=validation_msg
+                message=validation_msg,
+                metrics={}
             )
-            return jsonify(response), 400
+            return orjson_response(response, 400)
         
         # Process image request
-        result = process_image_request(data)
-        duration = time.time() - start_time
+        success, result, _ = _run_step("image_processing", process_image_request, data)
+        duration = (_pc() - start_ns) * 1e-9
         
-        success = result.get("status") == "success"
         app_metrics.record_response_time(duration, success=success)
         
         response = create_mcp_response(
@@ -625,11 +798,11 @@ def mcp_process_image():
             data=result
         )
         
-        logger.info(f"MCP Image Processing - Duration: {duration:.3f}s - Success: {success}")
-        return jsonify(response)
+        logger.info("MCP Image Processing - Duration: %.3fs - Success: %s", duration, success)
+        return orjson_response(response)
         
     except Exception as e:
-        duration = time.time() - start_time
+        duration = (_pc() - start_ns) * 1e-9
         app_metrics.record_response_time(duration, success=False)
         app_metrics.record_error("MCP_IMAGE_ERROR", str(e))
         
@@ -639,31 +812,32 @@ def mcp_process_image():
             message=f"Image processing error: {str(e)}"
         )
         
-        logger.error(f"MCP Image Processing failed - Duration: {duration:.3f}s - Error: {str(e)}")
-        return jsonify(response), 500
+        logger.error("MCP Image Processing failed - Duration: %.3fs - Error: %s", duration, e)
+        return orjson_response(response, 500)
 
 @mcp_app.route('/mcp/pdf', methods=['POST'])
 def mcp_process_pdf():
     """Process PDF conversion via MCP interface"""
-    start_time = time.time()
-    data = request.get_json(force=True)
+    start_ns = _pc()
+    data = request_json()
     
     try:
         # First validate
         is_valid, validation_msg = validate_request_data(data)
         if not is_valid:
+            # Empty metrics skip the snapshot so bad input is rejected cheaply
             response = create_mcp_response(
                 request_id=data.get("request_id", "unknown"),
                 status="validation_failed",
-                message=validation_msg
+                message=validation_msg,
+                metrics={}
             )
-            return jsonify(response), 400
+            return orjson_response(response, 400)
         
         # Process PDF request
-        result = process_pdf_request(data)
-        duration = time.time() - start_time
+        success, result, _ = _run_step("pdf_processing", process_pdf_request, data)
+        duration = (_pc() - start_ns) * 1e-9
         
-        success = result.get("status") == "success"
         app_metrics.record_response_time(duration, success=success)
         
         response = create_mcp_response(
@@ -673,11 +847,11 @@ def mcp_process_pdf():
             data=result
         )
         
-        logger.info(f"MCP PDF Processing - Duration: {duration:.3f}s - Success: {success}")
-        return jsonify(response)
+        logger.info("MCP PDF Processing - Duration: %.3fs - Success: %s", duration, success)
+        return orjson_response(response)
         
     except Exception as e:
-        duration = time.time() - start_time
+        duration = (_pc() - start_ns) * 1e-9
         app_metrics.record_response_time(duration, success=False)
         app_metrics.record_error("MCP_PDF_ERROR", str(e))
         
@@ -687,99 +861,161 @@ def mcp_process_pdf():
             message=f"PDF processing error: {str(e)}"
         )
         
-        logger.error(f"MCP PDF Processing failed - Duration: {duration:.3f}s - Error: {str(e)}")
-        return jsonify(response), 500
+        logger.error("MCP PDF Processing failed - Duration: %.3fs - Error: %s", duration, e)
+        return orjson_response(response, 500)
+
+def _integration_steps(data, test_type):
+    """Run the integration steps, yielding (passed, test_result) as each finishes"""
+    # Step 1: Validation
+    is_valid, validation_msg = validate_request_data(data)
+    yield is_valid, {
+        "test": "validation",
+        "status": "passed" if is_valid else "failed",
+        "message": validation_msg,
+        "duration": "0.001s"
+    }
+    if not is_valid:
+        return
+    
+    # Steps 2 and 3 are independent, so they run side by side
+    img_future = pdf_future = None
+    if test_type in ["image", "both"] and data.get("prompt"):
+        img_future = _EXEC.submit(_run_step, "image_processing", process_image_request, data)
+    if test_type in ["pdf", "both"] and data.get("html"):
+        pdf_future = _EXEC.submit(_run_step, "pdf_processing", process_pdf_request, data)
+    
+    # Step 2: Image processing (if requested)
+    if img_future is not None:
+        img_passed, img_result, img_duration_ns = img_future.result()
+        yield img_passed, {
+            "test": "image_processing",
+            "status": "passed" if img_passed else "failed",
+            "message": img_result.get("message", "Unknown error"),
+            "duration": f"{img_duration_ns * 1e-9:.3f}s",
+            "data": img_result
+        }
+    
+    # Step 3: PDF processing (if requested)
+    if pdf_future is not None:
+        pdf_passed, pdf_result, pdf_duration_ns = pdf_future.result()
+        yield pdf_passed, {
+            "test": "pdf_processing",
+            "status": "passed" if pdf_passed else "failed",
+            "message": pdf_result.get("message", "Unknown error"),
+            "duration": f"{pdf_duration_ns * 1e-9:.3f}s",
+            "data": pdf_result
+        }
+
+def _integration_summary(request_id, test_results, passed_tests, total_tests, start_ns):
+    """Record a finished integration test; test_results=None leaves them out of the body"""
+    total_duration = (_pc() - start_ns) * 1e-9
+    all_passed = passed_tests == total_tests
+    
+    app_metrics.record_response_time(total_duration, success=all_passed)
+    
+    data = {"test_results": test_results} if test_results is not None else {}
+    data["overall_status"] = "passed" if all_passed else "failed"
+    data["total_duration"] = f"{total_duration:.3f}s"
+    data["test_summary"] = {
+        "passed": passed_tests,
+        "total": total_tests,
+        "success_rate": f"{(passed_tests/total_tests*100):.1f}%"
+    }
+    response = create_mcp_response(
+        request_id=request_id,
+        status="success" if all_passed else "partial_failure",
+        message=f"Integration test completed - {passed_tests}/{total_tests} tests passed",
+        data=data
+    )
+    
+    logger.info("MCP Integration Test - Duration: %.3fs - Passed: %d/%d", total_duration, passed_tests, total_tests)
+    return response
+
+def _integration_error(data, e, start_ns):
+    duration = (_pc() - start_ns) * 1e-9
+    app_metrics.record_response_time(duration, success=False)
+    app_metrics.record_error("MCP_INTEGRATION_ERROR", str(e))
+    
+    response = create_mcp_response(
+        request_id=data.get("request_id", "unknown"),
+        status="error",
+        message=f"Integration test error: {str(e)}"
+    )
+    
+    logger.error("MCP Integration Test failed - Duration: %.3fs - Error: %s", duration, e)
+    return response
+
+def _stream_integration(data, test_type, request_id, start_ns, release):
+    """NDJSON body: one line per test result as it completes, then the summary"""
+    passed_tests = total_tests = 0
+    try:
+        try:
+            for passed, test_result in _integration_steps(data, test_type):
+                passed_tests += passed
+                total_tests += 1
+                yield orjson.dumps(test_result) + b"\n"
+            response = _integration_summary(request_id, None, passed_tests, total_tests, start_ns)
+        except Exception as e:
+            response = _integration_error(data, e, start_ns)
+        yield orjson.dumps(response) + b"\n"
+    finally:
+        # Frees the slot as soon as the body is done; WsgiToAsgi never calls close()
+        release()
 
 @mcp_app.route('/mcp/integration', methods=['POST'])
 def mcp_integration_test():
-    """Run full integration test via MCP interface"""
-    start_time = time.time()
-    data = request.get_json(force=True)
+    """Run full integration test via MCP interface (?stream=1 for NDJSON)"""
+    start_ns = _pc()
+    data = request_json()
     
     try:
         test_type = data.get("test_type", "both")
-        request_id = data.get("request_id", generate_test_uuid())
-        
-        test_results = []
+        request_id = data.get("request_id")
+        if request_id is None:
+            request_id = generate_test_uuid()
         
-        # Step 1: Validation
-        is_valid, validation_msg = validate_request_data(data)
-        test_results.append({
-            "test": "validation",
-            "status": "passed" if is_valid else "failed",
-            "message": validation_msg,
-            "duration": "0.001s"
-        })
-        
-        if is_valid:
-            # Step 2: Image processing (if requested)
-            if test_type in ["image", "both"] and data.get("prompt"):
-                img_start = time.time()
-                img_result = process_image_request(data)
-                img_duration = time.time() - img_start
-                
-                test_results.append({
-                    "test": "image_processing",
-                    "status": "passed" if img_result.get("status") == "success" else "failed",
-                    "message": img_result.get("message", "Unknown error"),
-                    "duration": f"{img_duration:.3f}s",
-                    "data": img_result
-                })
-            
-            # Step 3: PDF processing (if requested)
-            if test_type in ["pdf", "both"] and data.get("html"):
-                pdf_start = time.time()
-                pdf_result = process_pdf_request(data)
-                pdf_duration = time.time() - pdf_start
-                
-                test_results.append({
-                    "test": "pdf_processing",
-                    "status": "passed" if pdf_result.get("status") == "success" else "failed", 
-                    "message": pdf_result.get("message", "Unknown error"),
-                    "duration": f"{pdf_duration:.3f}s",
-                    "data": pdf_result
-                })
+        if not _HEAVY_SEM.acquire(timeout=_HEAVY_WAIT_SECONDS):
+            app_metrics.record_error("MCP_INTEGRATION_BUSY", "No free integration slot")
+            response = orjson_response(create_mcp_response(
+                request_id=request_id,
+                status="error",
+                message="Server busy - too many integration tests running, retry later",
+                metrics={}
+            ), 503)
+            response.headers["Retry-After"] = _HEAVY_RETRY_AFTER
+            return response
         
-        # Calculate results
-        total_duration = time.time() - start_time
-        passed_tests = len([t for t in test_results if t.get("status") == "passed"])
-        total_tests = len(test_results)
-        all_passed = passed_tests == total_tests
-        
-        app_metrics.record_response_time(total_duration, success=all_passed)
+        if request.args.get("stream") == "1":
+            release = _slot_releaser()
+            response = Response(
+                _stream_integration(data, test_type, request_id, start_ns, release),
+                mimetype="application/x-ndjson"
+            )
+            # Covers a body that is closed before it ever starts
+            response.call_on_close(release)
+            return response
         
-        response = create_mcp_response(
-            request_id=request_id,
-            status="success" if all_passed else "partial_failure",
-            message=f"Integration test completed - {passed_tests}/{total_tests} tests passed",
-            data={
-                "test_results": test_results,
-                "overall_status": "passed" if all_passed else "failed",
-                "total_duration": f"{total_duration:.3f}s",
-                "test_summary": {
-                    "passed": passed_tests,
-                    "total": total_tests,
-                    "success_rate": f"{(passed_tests/total_tests*100):.1f}%"
-                }
-            }
-        )
+        try:
+            test_results = []
+            passed_tests = 0
+            for passed, test_result in _integration_steps(data, test_type):
+                passed_tests += passed
+                test_results.append(test_result)
+        finally:
+            _HEAVY_SEM.release()
         
-        logger.info(f"MCP Integration Test - Duration: {total_duration:.3f}s - Passed: {passed_tests}/{total_tests}")
-        return jsonify(response)
+        response = _integration_summary(request_id, test_results, passed_tests, len(test_results), start_ns)
+        return orjson_response(response)
         
     except Exception as e:
-        duration = time.time() - start_time
-        app_metrics.record_response_time(duration, success=False)
-        app_metrics.record_error("MCP_INTEGRATION_ERROR", str(e))
-        
-        response = create_mcp_response(
-            request_id=data.get("request_id", "unknown"),
-            status="error",
-            message=f"Integration test error: {str(e)}"
-        )
-        
-        logger.error(f"MCP Integration Test failed - Duration: {duration:.3f}s - Error: {str(e)}")
-        return jsonify(response), 500
+        return orjson_response(_integration_error(data, e, start_ns), 500)
+
+# -------------------------------------------------------------------
+# ASGI ENTRY POINT
+# -------------------------------------------------------------------
+# For uvicorn (uvloop + httptools); mcp_app stays the WSGI entry point:
+#   uvicorn --loop uvloop --http httptools --workers 4 mcp_web_server:asgi_app
+asgi_app = WsgiToAsgi(mcp_app)
 
 # -------------------------------------------------------------------
 # MAIN